@@ -0,0 +1,12 @@
+"""Gunicorn config: start the bot from a worker hook instead of at import time."""
+
+def post_worker_init(worker):
+    # start_bot() takes BOT_LOCK_FILE, so only the first worker to get there runs the bot
+    from main import start_bot
+    start_bot()
+
+def worker_exit(server, worker):
+    # Wake the bot loop and WebSocket supervisor, cancel queued Telegram sends, and wait up to 5s for
+    # bot_loop to close the socket. Best-effort: if the join times out the daemon thread dies with the worker
+    from main import stop_bot
+    stop_bot()
@@ -1,24 +1,75 @@
 import os
 import time
+import atexit
 import threading
 import logging
+import queue
+import functools
+import importlib.util
+import random
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dtime, timedelta, timezone
 from flask import Flask, jsonify
+import socket
+import struct
+import orjson
 import pyotp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 
-# ---- SmartAPI import (FIXED) ----
-SmartConnect = None
-try:
-    from SmartApi import SmartConnect as _SC
-    SmartConnect = _SC
-    logging.info("SmartConnect imported successfully!")
-except Exception as e:
-    logging.error(f"Failed to import SmartConnect: {e}")
-    SmartConnect = None
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+# Callers only enqueue log records; a listener thread does the actual stream writes
+_log_queue = queue.Queue(-1)
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+_log_listener = QueueListener(_log_queue, _log_stream)
+_log_enqueue = QueueHandler(_log_queue)
+_log_enqueue.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_log_enqueue])
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger('angel-railway-bot-http')
 
+# ---- SmartAPI import (lazy) ----
+# The SDK pulls in a large dependency tree, so it is imported on the first login, not at app startup
+SmartConnect = None
+LtpWebSocket = None
+SMARTAPI_INSTALLED = importlib.util.find_spec('SmartApi') is not None
+
+def _load_smartapi():
+    """Import the SmartAPI SDK once; returns (SmartConnect, LtpWebSocket)."""
+    global SmartConnect, LtpWebSocket
+    if SmartConnect is None:
+        try:
+            from SmartApi import SmartConnect as _SC
+            from SmartApi.smartWebSocketV2 import SmartWebSocketV2
+        except Exception as e:
+            logger.error("Failed to import SmartConnect: %s", e)
+            raise RuntimeError('SmartAPI SDK not available. Check requirements.txt installation.') from e
+
+        class _LtpWebSocket(SmartWebSocketV2):
+            """SmartWebSocketV2 that passes raw binary ticks to on_data, skipping the SDK's field-by-field parse."""
+            def _on_data(self, wsapp, data, data_type, continue_flag):
+                if data_type == 2:
+                    self.on_data(wsapp, data)
+
+            def _on_open(self, wsapp):
+                # The SDK resubscribes on reconnect without calling on_open; call it either way
+                if self.RESUBSCRIBE_FLAG:
+                    self.resubscribe()
+                self.on_open(wsapp)
+
+            def _on_close(self, wsapp, *args):
+                # websocket-client passes (ws, code, reason); the SDK's one-argument _on_close raises TypeError
+                self.on_close(wsapp)
+
+        LtpWebSocket = _LtpWebSocket
+        SmartConnect = _SC
+        logger.info("SmartConnect imported successfully!")
+    return SmartConnect, LtpWebSocket
+
 # Load config from env
 API_KEY = os.getenv('SMARTAPI_API_KEY')
 CLIENT_ID = os.getenv('SMARTAPI_CLIENT_ID')
@@ -27,38 +78,216 @@ TOTP_SECRET = os.getenv('SMARTAPI_TOTP_SECRET')
 TELE_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELE_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 POLL_INTERVAL = int(os.getenv('POLL_INTERVAL') or 60)
+# Send even without price changes at least once every SEND_EVERY_CYCLES polls
+SEND_EVERY_CYCLES = int(os.getenv('SEND_EVERY_CYCLES') or 10)
+PRICE_EPSILON_PAISE = 5
+TELEGRAM_MAX_LEN = 4096
+TELEGRAM_MAX_PENDING = 32
+TELEGRAM_URL = f"https://api.telegram.org/bot{TELE_TOKEN}/sendMessage"
+# Set to 0 to keep sending updates outside NSE market hours
+MARKET_HOURS_ONLY = os.getenv('MARKET_HOURS_ONLY', '1') == '1'
+TELEGRAM_MAX_ATTEMPTS = 3
+MAX_BACKOFF = 600
+ALERT_BACKOFF_START = 60
+ALERT_BACKOFF_MAX = 300
+
+IST = timezone(timedelta(hours=5, minutes=30))
+MARKET_OPEN = dtime(9, 15)
+MARKET_CLOSE = dtime(15, 30)
 
 REQUIRED = [API_KEY, CLIENT_ID, PASSWORD, TOTP_SECRET, TELE_TOKEN, TELE_CHAT_ID]
 
+# Symbol tokens, all on exchangeType 1 (NSE_CM) for both the indices and the equities
+# Token search: https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json
+SYMBOLS = {
+    'NIFTY 50': '99926000',
+    'NIFTY BANK': '99926009',
+    'TCS': '11536',
+    'HDFCBANK': '1333',
+    'SBIN': '3045',
+    'RELIANCE': '2885'
+}
+TOKEN_TO_NAME = {tok: name for name, tok in SYMBOLS.items()}
+ALL_TOKENS = list(SYMBOLS.values())
+
+# Static parts of the direct market-data REST call, built once
+ANGEL_QUOTE_URL = 'https://apiconnect.angelbroking.com/rest/secure/angelbroking/market/v1/quote/'
+# Built once; only Authorization changes, in place, when the session token does (see set_angel_auth)
+ANGEL_HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+    'X-UserType': 'USER',
+    'X-SourceID': 'WEB',
+    'X-ClientLocalIP': '127.0.0.1',
+    'X-ClientPublicIP': '127.0.0.1',
+    'X-MACAddress': '00:00:00:00:00:00',
+    'X-PrivateKey': API_KEY
+}
+_PAYLOAD = {
+    "mode": "LTP",
+    "exchangeTokens": {
+        "NSE": ALL_TOKENS
+    }
+}
+_PAYLOAD_BODY = orjson.dumps(_PAYLOAD)
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+INDICES = ['NIFTY 50', 'NIFTY BANK']
+STOCKS = ['TCS', 'HDFCBANK', 'SBIN', 'RELIANCE']
+DISPLAY_ORDER = INDICES + STOCKS
+
+# Price update layout, built once; filled positionally in DISPLAY_ORDER plus ts and source
+MSG_TEMPLATE = "\n".join(
+    ["📊 <b>INDICES</b>"]
+    + [f"  • {name}: {{{i}}}" for i, name in enumerate(INDICES)]
+    + ["\n📈 <b>STOCKS</b>"]
+    + [f"  • {name}: {{{i}}}" for i, name in enumerate(STOCKS, len(INDICES))]
+    + ["\n🕐 {ts}", "📡 {source}"]
+)
+
+# Binary tick layout: mode(1) exchange_type(1) token(25) sequence(8) exchange_ts(8) ltp(8, int64 paise)
+LTP_PACKET_LEN = 51
+TICK_SUMMARY_INTERVAL = 60
+_LTP = struct.Struct('<q')
+
+# Latest LTP per symbol name in integer paise, filled by the WebSocket on_data callback
+latest_prices = {}
+# Set by on_open once the WebSocket is connected, cleared again by on_close
+ws_ready = threading.Event()
+# Set by on_data on the first stored tick; on_open only sends the subscribe request
+first_tick = threading.Event()
+WS_CONNECT_TIMEOUT = 10
+# Monotonic time latest_prices was last refreshed by a tick or the REST fallback
+last_price_update = None
+# Monotonic time the WebSocket went down (None while connected); REST fallback kicks in after WS_FALLBACK_AFTER
+ws_down_since = None
+WS_FALLBACK_AFTER = 120
+WS_MAX_RECONNECT_DELAY = 60
+
+# Set on process exit so the bot loop wakes from its wait and stops immediately
+stop_event = threading.Event()
+atexit.register(stop_event.set)
+
 app = Flask(__name__)
 
-def tele_send_http(chat_id: str, text: str):
-    """Send message using Telegram Bot HTTP API via requests (synchronous)."""
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that also enables TCP keepalive on pooled sockets (TCP_NODELAY is urllib3's default)."""
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(*args, **kwargs)
+
+# Shared HTTP session: keeps TLS connections to Telegram and Angel alive between calls
+SESSION = requests.Session()
+SESSION.mount('https://', KeepAliveAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.3)))
+# The quote POST is read-only, so gateway errors from Angel can be retried on the pooled connection too
+# (Telegram is not: _tele_post handles its 429/5xx itself so a message is never sent twice)
+SESSION.mount('https://apiconnect.angelbroking.com/', KeepAliveAdapter(pool_connections=1, pool_maxsize=4, max_retries=Retry(
+    total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=None, raise_on_status=False)))
+
+def backoff_delay(backoff):
+    """Cap a retry delay at MAX_BACKOFF and add up to 10% jitter so retries don't line up."""
+    delay = min(backoff, MAX_BACKOFF)
+    return delay + random.uniform(0, delay * 0.1)
+
+# Single background sender so Telegram round-trips never block the bot loop (keeps message order)
+TELEGRAM_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='telegram')
+# Bounds queued + in-flight messages so a Telegram outage can't grow the backlog without limit
+_telegram_slots = threading.BoundedSemaphore(TELEGRAM_MAX_PENDING)
+
+def tele_send_http(chat_id: str, text: str, parse_mode: str = None):
+    """Queue a Telegram message for the background sender; returns a Future resolving to the send result, or None if dropped."""
+    if stop_event.is_set():
+        # stop_bot() shuts the pool down right after setting stop_event
+        return None
+    if not _telegram_slots.acquire(blocking=False):
+        logger.warning('Telegram queue full (%d pending), dropping message', TELEGRAM_MAX_PENDING)
+        return None
     try:
-        token = TELE_TOKEN
-        if not token:
-            logger.error('TELEGRAM_BOT_TOKEN not set, cannot send Telegram message.')
-            return False
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
+        future = TELEGRAM_POOL.submit(_tele_post, chat_id, text, parse_mode)
+    except RuntimeError:
+        # Pool shut down between the stop_event check and submit
+        _telegram_slots.release()
+        return None
+    future.add_done_callback(lambda _: _telegram_slots.release())
+    return future
+
+def _tele_post(chat_id: str, text: str, parse_mode: str = None):
+    """Send message using Telegram Bot HTTP API via the shared session (synchronous)."""
+    try:
+        if len(text) > TELEGRAM_MAX_LEN:
+            text = text[:TELEGRAM_MAX_LEN - 1] + '…'
         payload = {
             "chat_id": chat_id,
-            "text": text,
-            "parse_mode": "HTML"
+            "text": text
         }
-        r = requests.post(url, json=payload, timeout=10)
-        if r.status_code != 200:
-            logger.warning('Telegram API returned %s: %s', r.status_code, r.text)
-            return False
-        return True
+        # Plain text by default: status/error texts may contain a stray '<' that HTML mode rejects
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        body = orjson.dumps(payload)
+        backoff = 1
+        for attempt in range(1, TELEGRAM_MAX_ATTEMPTS + 1):
+            try:
+                r = SESSION.post(TELEGRAM_URL, data=body, headers=_JSON_HEADERS, timeout=10)
+            except requests.RequestException as e:
+                logger.warning('Telegram send failed (attempt %d/%d): %s', attempt, TELEGRAM_MAX_ATTEMPTS, e)
+                delay = backoff
+            else:
+                if r.status_code == 200:
+                    return True
+                # Other 4xx (bad chat id, malformed text) will not succeed on retry
+                if r.status_code != 429 and r.status_code < 500:
+                    logger.warning('Telegram API returned %s: %s', r.status_code, r.content[:512])
+                    return False
+                logger.warning('Telegram API returned %s (attempt %d/%d)', r.status_code, attempt, TELEGRAM_MAX_ATTEMPTS)
+                delay = backoff
+                if r.status_code == 429:
+                    try:
+                        delay = max(delay, orjson.loads(r.content)['parameters']['retry_after'])
+                    except Exception:
+                        pass
+            if attempt == TELEGRAM_MAX_ATTEMPTS or stop_event.wait(backoff_delay(delay)):
+                break
+            backoff *= 2
+        return False
     except Exception as e:
         logger.exception('Failed to send Telegram message: %s', e)
         return False
 
+# Repeated alert suppression, used from the bot loop thread only
+_last_alert_text = None
+_last_alert_ts = 0.0
+_alert_backoff = ALERT_BACKOFF_START
+
+def tele_send_dedup(chat_id: str, text: str):
+    """Send an alert, suppressing identical repeats for a backoff that doubles up to ALERT_BACKOFF_MAX."""
+    global _last_alert_text, _last_alert_ts, _alert_backoff
+    now = time.monotonic()
+    if text == _last_alert_text:
+        if now - _last_alert_ts < _alert_backoff:
+            logger.info('Suppressing repeated alert for up to %ds', _alert_backoff - (now - _last_alert_ts))
+            return None
+        _alert_backoff = min(_alert_backoff * 2, ALERT_BACKOFF_MAX)
+    else:
+        _alert_backoff = ALERT_BACKOFF_START
+    _last_alert_text = text
+    _last_alert_ts = now
+    return tele_send_http(chat_id, text)
+
+def reset_alerts():
+    """Forget the last alert once things recover, so the next failure is reported immediately."""
+    global _last_alert_text, _alert_backoff
+    _last_alert_text = None
+    _alert_backoff = ALERT_BACKOFF_START
+
+@functools.lru_cache(maxsize=1)
+def _get_totp(totp_secret):
+    """One TOTP object per secret, so re-logins skip the base32 decode."""
+    return pyotp.TOTP(totp_secret)
+
 def login_and_setup(api_key, client_id, password, totp_secret):
-    if SmartConnect is None:
-        raise RuntimeError('SmartAPI SDK not available. Check requirements.txt installation.')
-    smartApi = SmartConnect(api_key=api_key)
-    totp = pyotp.TOTP(totp_secret).now()
+    smart_connect_cls, _ = _load_smartapi()
+    smartApi = smart_connect_cls(api_key=api_key)
+    totp = _get_totp(totp_secret).now()
     logger.info('Logging in to SmartAPI...')
     data = smartApi.generateSession(client_id, password, totp)
     if not data or data.get('status') is False:
@@ -73,98 +302,143 @@ def login_and_setup(api_key, client_id, password, totp_secret):
         smartApi.generateToken(refreshToken)
     except Exception:
         pass
+    set_angel_auth(smartApi)
     return smartApi, authToken, refreshToken, feedToken
 
+def set_angel_auth(smartApi):
+    """Update the cached ANGEL_HEADERS with the session's current JWT (after login or token refresh)."""
+    ANGEL_HEADERS['Authorization'] = f'Bearer {smartApi.access_token}'
+
+def _parse_quote_response(data):
+    """Map a market/v1/quote LTP response to {symbol name: ltp}."""
+    result = {}
+    if data and data.get('status'):
+        for item in data.get('data', {}).get('fetched', []):
+            name = TOKEN_TO_NAME.get(item.get('symbolToken', ''))
+            if name:
+                result[name] = float(item.get('ltp') or 0)
+    return result
+
 def get_market_data_angel(smartApi):
-    """Get live index and stock data using Angel One Market Data API"""
+    """Get live index and stock data using Angel One Market Data API (one batched request per call)"""
     try:
-        # Define symbols with their tokens
-        # Token search: https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json
-        symbols = {
-            'NIFTY 50': '99926000',
-            'NIFTY BANK': '99926009',
-            'TCS': '11536',
-            'HDFCBANK': '1333',
-            'SBIN': '3045',
-            'RELIANCE': '2885'
-        }
-        
-        result = {}
-        
-        # Method 1: Try getMarketData if available in SDK
+        # Method 1: getMarketData if available in SDK. Any answer it gets counts;
+        # only an exception falls through, so one call never costs two requests.
         if hasattr(smartApi, 'getMarketData'):
             try:
-                # Batch request for all symbols
-                all_tokens = list(symbols.values())
-                data = smartApi.getMarketData('LTP', {'NSE': all_tokens})
-                logger.info(f"Batch API response: {data}")
-                
-                if data and data.get('status'):
-                    fetched = data.get('data', {}).get('fetched', [])
-                    for item in fetched:
-                        token = item.get('symbolToken', '')
-                        ltp = item.get('ltp', 0)
-                        # Find symbol name by token
-                        for name, tok in symbols.items():
-                            if tok == token:
-                                result[name] = float(ltp) if ltp else 0
-                                break
-                
-                if result:
-                    return result
+                data = smartApi.getMarketData('LTP', {'NSE': ALL_TOKENS})
+                logger.debug("getMarketData response: %s", data)
+                return _parse_quote_response(data) or None
             except Exception as e:
-                logger.warning(f"getMarketData method failed: {e}")
+                logger.warning("getMarketData method failed: %s", e)
         
         # Method 2: Direct API call (batch)
-        headers = {
-            'Authorization': f'Bearer {smartApi.access_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'X-UserType': 'USER',
-            'X-SourceID': 'WEB',
-            'X-ClientLocalIP': '127.0.0.1',
-            'X-ClientPublicIP': '127.0.0.1',
-            'X-MACAddress': '00:00:00:00:00:00',
-            'X-PrivateKey': API_KEY
-        }
-        
-        # Try batch request
-        payload = {
-            "mode": "LTP",
-            "exchangeTokens": {
-                "NSE": list(symbols.values())
-            }
-        }
-        
-        response = requests.post(
-            'https://apiconnect.angelbroking.com/rest/secure/angelbroking/market/v1/quote/',
-            json=payload,
-            headers=headers,
-            timeout=10
-        )
-        
-        logger.info(f"Batch API response: {response.status_code}")
+        response = SESSION.post(ANGEL_QUOTE_URL, data=_PAYLOAD_BODY, headers=ANGEL_HEADERS, timeout=10)
         
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status'):
-                fetched = data.get('data', {}).get('fetched', [])
-                for item in fetched:
-                    token = item.get('symbolToken', '')
-                    ltp = item.get('ltp', 0)
-                    # Find symbol name by token
-                    for name, tok in symbols.items():
-                        if tok == token:
-                            result[name] = float(ltp) if ltp else 0
-                            break
+        logger.debug("Direct quote API response: %s", response.status_code)
         
-        return result if result else None
+        if not response.ok:
+            logger.warning('%s %s %s', response.url, response.status_code, response.content[:512])
+            return None
+        return _parse_quote_response(orjson.loads(response.content)) or None
         
     except Exception as e:
-        logger.exception(f"Failed to fetch Angel market data: {e}")
+        logger.exception("Failed to fetch Angel market data: %s", e)
         return None
 
+class WebSocketHandlers:
+    """SmartWebSocketV2 callbacks; per-tick state lives in slots rather than closures or globals."""
+    __slots__ = ('sws', 'prices', 'token_to_name', 'token_list', 'tick_count', 'next_summary')
+
+    def __init__(self, sws, prices, token_to_name):
+        self.sws = sws
+        self.prices = prices
+        self.token_to_name = token_to_name
+        self.token_list = [{'exchangeType': 1, 'tokens': list(token_to_name)}]
+        self.tick_count = 0
+        self.next_summary = time.monotonic() + TICK_SUMMARY_INTERVAL
+
+    def on_data(self, wsapp, message):
+        global last_price_update
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('ws msg len=%d', len(message))
+        if len(message) < LTP_PACKET_LEN:
+            return
+        name = self.token_to_name.get(message[2:27].split(b'\x00', 1)[0].decode())
+        now = time.monotonic()
+        if name:
+            self.prices[name] = _LTP.unpack_from(message, 43)[0]
+            last_price_update = now
+            if not first_tick.is_set():
+                first_tick.set()
+        # Periodic summary instead of a log line per tick
+        self.tick_count += 1
+        if now >= self.next_summary:
+            logger.info('Received %d ticks in the last %ds', self.tick_count, TICK_SUMMARY_INTERVAL)
+            self.tick_count = 0
+            self.next_summary = now + TICK_SUMMARY_INTERVAL
+
+    def on_open(self, wsapp):
+        global ws_down_since
+        ws_down_since = None
+        ws_ready.set()
+        sws = self.sws
+        if sws.RESUBSCRIBE_FLAG:
+            logger.info('WebSocket reconnected, subscriptions restored')
+            return
+        logger.info('WebSocket opened, subscribing to %d tokens', len(self.token_to_name))
+        # Fresh per-instance request dict: the SDK's default is a shared class attribute that only grows
+        sws.input_request_dict = {}
+        sws.subscribe('angel-bot', sws.LTP_MODE, self.token_list)
+
+    def on_error(self, *args):
+        logger.error('WebSocket error: %s', args)
+
+    def on_close(self, wsapp):
+        global ws_down_since
+        ws_ready.clear()
+        if ws_down_since is None:
+            ws_down_since = time.monotonic()
+        logger.warning('WebSocket closed')
+
+def setup_websocket(authToken, feedToken):
+    """Create a SmartWebSocketV2 client that keeps `latest_prices` updated from LTP ticks."""
+    _, ws_cls = _load_smartapi()
+    # Reconnects are handled by run_websocket, not by the SDK's nested retry in _on_error
+    sws = ws_cls(authToken, API_KEY, CLIENT_ID, feedToken, max_retry_attempt=0)
+    handlers = WebSocketHandlers(sws, latest_prices, TOKEN_TO_NAME)
+    sws.on_data = handlers.on_data
+    sws.on_open = handlers.on_open
+    sws.on_error = handlers.on_error
+    sws.on_close = handlers.on_close
+    return sws
+
+def run_websocket(sws):
+    """Keep the WebSocket connected, reconnecting with backoff until stop_event is set."""
+    global ws_down_since
+    ws_down_since = time.monotonic()
+    backoff = 1
+    while not stop_event.is_set():
+        connected_at = time.monotonic()
+        try:
+            sws.connect()
+        except Exception as e:
+            logger.warning('WebSocket connect failed: %s', e)
+        ws_ready.clear()
+        if ws_down_since is None:
+            ws_down_since = time.monotonic()
+        if stop_event.is_set():
+            break
+        # A connection that stayed up for a while starts the backoff over
+        if time.monotonic() - connected_at > WS_MAX_RECONNECT_DELAY:
+            backoff = 1
+        logger.warning('WebSocket disconnected, reconnecting in ~%ss', backoff)
+        if stop_event.wait(backoff_delay(backoff)):
+            break
+        backoff = min(backoff * 2, WS_MAX_RECONNECT_DELAY)
+
 def bot_loop():
+    global last_price_update
     if not all(REQUIRED):
         logger.error('Missing required environment variables. Bot will not start.')
         return
@@ -177,59 +451,192 @@ def bot_loop():
         tele_send_http(TELE_CHAT_ID, f'❌ Login failed: {e}')
         return
 
-    tele_send_http(TELE_CHAT_ID, f"✅ Bot started! Polling every {POLL_INTERVAL}s\n📊 Using Angel One Market Data API")
+    try:
+        sws = setup_websocket(authToken, feedToken)
+        threading.Thread(target=run_websocket, args=(sws,), name='websocket', daemon=True).start()
+    except Exception as e:
+        logger.exception('WebSocket setup failed: %s', e)
+        tele_send_http(TELE_CHAT_ID, f'❌ WebSocket setup failed: {e}')
+        return
+
+    # Wake as soon as the first tick is cached, so the first cycle doesn't find an empty cache;
+    # poll in short slices so a stop request isn't held up for the whole timeout
+    deadline = time.monotonic() + WS_CONNECT_TIMEOUT
+    while not first_tick.wait(timeout=min(0.5, max(0, deadline - time.monotonic()))):
+        if stop_event.is_set() or time.monotonic() >= deadline:
+            break
+    if stop_event.is_set():
+        logger.info('Stop requested, closing WebSocket')
+        sws.close_connection()
+        return
+    if not first_tick.is_set():
+        if ws_ready.is_set():
+            logger.warning('WebSocket connected but no tick within %ss', WS_CONNECT_TIMEOUT)
+        else:
+            logger.error('WebSocket did not connect within %ss, retrying in the background', WS_CONNECT_TIMEOUT)
+            tele_send_http(TELE_CHAT_ID, f'⚠️ WebSocket not connected after {WS_CONNECT_TIMEOUT}s, retrying in the background')
 
+    tele_send_http(TELE_CHAT_ID, f"✅ Bot started! Updates every {POLL_INTERVAL}s\n📊 Using Angel One WebSocket feed")
+
+    last_sent_prices = {}
+    cycles_since_send = 0
+    backoff = POLL_INTERVAL
+    # Cycles run on a fixed monotonic grid so the time spent in each cycle doesn't shift the schedule
+    next_tick = time.monotonic()
+    market_closed = False
     while True:
+        # Outside market hours prices don't move: skip the cycle and check again later
+        if MARKET_HOURS_ONLY and not market_open():
+            if not market_closed:
+                logger.info('Market closed, pausing updates')
+                tele_send_http(TELE_CHAT_ID, '🌙 Market closed, pausing updates until the next session')
+                market_closed = True
+            if stop_event.wait(min(POLL_INTERVAL * 10, 600)):
+                break
+            next_tick = time.monotonic()
+            continue
+        if market_closed:
+            logger.info('Market open, resuming updates')
+            market_closed = False
+
+        wait_for = None
         try:
-            # Get live data from Angel One
-            prices = get_market_data_angel(smartApi)
-            
-            if prices and any(prices.values()):
-                messages = []
-                ts = time.strftime('%Y-%m-%d %H:%M:%S')
-                
-                # Indices first
-                messages.append("📊 <b>INDICES</b>")
-                for name in ['NIFTY 50', 'NIFTY BANK']:
-                    ltp = prices.get(name, 0)
-                    if ltp and ltp > 0:
-                        messages.append(f"  • {name}: ₹{ltp:,.2f}")
-                
-                # Stocks
-                messages.append("\n📈 <b>STOCKS</b>")
-                for name in ['TCS', 'HDFCBANK', 'SBIN', 'RELIANCE']:
-                    ltp = prices.get(name, 0)
-                    if ltp and ltp > 0:
-                        messages.append(f"  • {name}: ₹{ltp:,.2f}")
-                
-                messages.append(f"\n🕐 {ts}")
-                messages.append(f"📡 Angel One API")
-                
-                text = "\n".join(messages)
-                logger.info('Sending update')
-                tele_send_http(TELE_CHAT_ID, text)
+            source = 'Angel One WebSocket'
+            rest_failed = False
+            # Last-resort REST pull when the WebSocket has been down for too long
+            down_since = ws_down_since
+            if down_since is not None and time.monotonic() - down_since > WS_FALLBACK_AFTER:
+                logger.warning('WebSocket down for %ds, falling back to REST', time.monotonic() - down_since)
+                fetched = get_market_data_angel(smartApi)
+                if fetched:
+                    latest_prices.update({name: round(ltp * 100) for name, ltp in fetched.items()})
+                    last_price_update = time.monotonic()
+                    source = 'Angel One REST (WebSocket down)'
+                else:
+                    rest_failed = True
+
+            # Snapshot the prices pushed by the WebSocket feed
+            prices = dict(latest_prices)
+
+            # A connected but quiet feed (holiday, after hours) keeps sending the cached prices;
+            # only hold them back when the socket is down and this cycle's REST pull failed
+            if prices and any(prices.values()) and not rest_failed:
+                # Only send when a price moved or the heartbeat cycle is due
+                cycles_since_send += 1
+                changed = [k for k, v in prices.items() if abs(v - last_sent_prices.get(k, 0)) > PRICE_EPSILON_PAISE]
+                if not changed and cycles_since_send < SEND_EVERY_CYCLES:
+                    logger.info('No price change, skipping update (%d/%d)', cycles_since_send, SEND_EVERY_CYCLES)
+                else:
+                    text = MSG_TEMPLATE.format(
+                        *[f"₹{prices[name] * 0.01:,.2f}" if prices.get(name, 0) > 0 else 'N/A' for name in DISPLAY_ORDER],
+                        ts=time.strftime('%Y-%m-%d %H:%M:%S'), source=source)
+                    logger.info('Sending update')
+                    tele_send_http(TELE_CHAT_ID, text, parse_mode='HTML')
+                    last_sent_prices.update(prices)
+                    cycles_since_send = 0
+                backoff = POLL_INTERVAL
+                reset_alerts()
+            elif prices:
+                # Cached prices can't be refreshed: don't resend them as live
+                logger.error("WebSocket down and REST fallback failed, prices are %ds old, retrying in ~%ss",
+                             time.monotonic() - last_price_update, min(backoff, MAX_BACKOFF))
+                tele_send_dedup(TELE_CHAT_ID, "⚠️ Price data is stale: WebSocket down and REST fallback failed")
+                wait_for = backoff_delay(backoff)
+                backoff *= 2
             else:
-                logger.error("No data received from Angel API")
-                tele_send_http(TELE_CHAT_ID, "⚠️ Unable to fetch data from Angel One")
+                logger.error("No data received from Angel WebSocket, retrying in ~%ss", min(backoff, MAX_BACKOFF))
+                tele_send_dedup(TELE_CHAT_ID, "⚠️ Waiting for data from Angel One")
+                wait_for = backoff_delay(backoff)
+                backoff *= 2
             
         except Exception as e:
-            logger.exception(f"Error in bot loop: {e}")
-            tele_send_http(TELE_CHAT_ID, f"⚠️ Error: {e}")
+            logger.exception("Error in bot loop: %s", e)
+            tele_send_dedup(TELE_CHAT_ID, f"⚠️ Error: {e}")
+            wait_for = backoff_delay(backoff)
+            backoff *= 2
         
-        time.sleep(POLL_INTERVAL)
+        now = time.monotonic()
+        if wait_for is None:
+            next_tick += POLL_INTERVAL
+            # Overran a whole interval: skip the missed ticks instead of firing them back to back
+            if next_tick < now:
+                next_tick = now + POLL_INTERVAL
+            wait_for = next_tick - now
+        else:
+            # Backing off: restart the grid after the delay
+            next_tick = now + wait_for
+        if stop_event.wait(wait_for):
+            break
+
+    logger.info('Stop requested, closing WebSocket')
+    sws.close_connection()
+
+def market_open(now=None):
+    """True during NSE cash-market hours (Mon-Fri 09:15-15:30 IST). Exchange holidays are not known here."""
+    now = now or datetime.now(tz=IST)
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() <= MARKET_CLOSE
 
-# Start bot in a background thread
-thread = threading.Thread(target=bot_loop, daemon=True)
-thread.start()
+bot_thread = None
+_start_lock = threading.Lock()
+BOT_LOCK_FILE = os.getenv('BOT_LOCK_FILE', '/tmp/angel-bot.lock')
+# Kept open while this process runs the bot; the OS drops the lock when the process exits
+_bot_lock_file = None
+
+def _acquire_bot_lock():
+    """Take the host-wide bot lock without blocking; False if another process already holds it."""
+    global _bot_lock_file
+    try:
+        import fcntl
+    except ImportError:
+        # Non-POSIX dev machine: no cross-process guard
+        return True
+    try:
+        f = open(BOT_LOCK_FILE, 'w')
+    except OSError as e:
+        # Can't tell whether another process runs the bot, so don't risk a second one
+        logger.error('Cannot open bot lock file %s: %s', BOT_LOCK_FILE, e)
+        return False
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _bot_lock_file = f
+    return True
+
+def start_bot():
+    """Start bot_loop in a background thread, at most once per host (BOT_LOCK_FILE). Set START_BOT=0 to disable."""
+    global bot_thread
+    with _start_lock:
+        if bot_thread is None and os.getenv('START_BOT', '1') == '1':
+            if not _acquire_bot_lock():
+                logger.info('Bot lock not acquired, not starting the bot in pid %s', os.getpid())
+                return None
+            bot_thread = threading.Thread(target=bot_loop, name='bot-loop', daemon=True)
+            bot_thread.start()
+    return bot_thread
+
+def stop_bot(timeout=5):
+    """Wake the bot loop and drop queued Telegram sends, then give bot_loop up to timeout seconds to close the WebSocket."""
+    stop_event.set()
+    TELEGRAM_POOL.shutdown(wait=False, cancel_futures=True)
+    if bot_thread is not None:
+        bot_thread.join(timeout)
 
 @app.route('/')
 def index():
     status = {
-        'bot_thread_alive': thread.is_alive(),
+        'bot_thread_alive': bot_thread is not None and bot_thread.is_alive(),
         'poll_interval': POLL_INTERVAL,
-        'smartapi_sdk_available': SmartConnect is not None
+        'smartapi_sdk_available': SMARTAPI_INSTALLED
     }
     return jsonify(status)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=int(os.getenv('PORT', 8080)))
+    # Local dev: no Gunicorn hook, so start the bot here
+    start_bot()
+    try:
+        app.run(host='0.0.0.0', port=int(os.getenv('PORT', 8080)))
+    finally:
+        # concurrent.futures joins the pool before atexit runs, so stop it here
+        stop_bot()